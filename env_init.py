@@ -0,0 +1,11 @@
+"""
+One-time environment setup shared by the agent and token scripts
+"""
+
+import functools
+
+@functools.cache
+def init():
+    """Load .env into os.environ; repeated calls are no-ops"""
+    from dotenv import load_dotenv
+    load_dotenv()
@@ -3,12 +3,31 @@
 Generate LiveKit access tokens
 """
 
+import functools
 import os
-from dotenv import load_dotenv
+import time
 from livekit.api import AccessToken, VideoGrants
 
+import env_init
+
 # Load environment variables
-load_dotenv()
+env_init.init()
+
+@functools.lru_cache(maxsize=64)
+def _signed_token(api_key: str, api_secret: str, room_name: str,
+                  participant_name: str, hour_bucket: int) -> str:
+    # hour_bucket only keys the cache so cached tokens are re-signed hourly
+    token = AccessToken(api_key, api_secret)
+    token.with_grants(VideoGrants(
+        room_join=True,
+        room=room_name,
+        can_publish=True,
+        can_subscribe=True
+    ))
+    token.with_name(participant_name)
+    token.with_identity(participant_name)
+    
+    return token.to_jwt()
 
 def generate_token(room_name: str, participant_name: str) -> str:
     """
@@ -27,17 +46,8 @@ def generate_token(room_name: str, participant_name: str) -> str:
     if not api_key or not api_secret:
         raise ValueError("LIVEKIT_API_KEY and LIVEKIT_API_SECRET must be set in .env file")
     
-    token = AccessToken(api_key, api_secret)
-    token.with_grants(VideoGrants(
-        room_join=True,
-        room=room_name,
-        can_publish=True,
-        can_subscribe=True
-    ))
-    token.with_name(participant_name)
-    token.with_identity(participant_name)
-    
-    return token.to_jwt()
+    return _signed_token(api_key, api_secret, room_name, participant_name,
+                         int(time.time() // 3600))
 
 if __name__ == "__main__":
     # Example usage
@@ -5,14 +5,55 @@ Simple, clear echo with minimal processing
 """
 
 import asyncio
+import functools
 import os
 import time
 import numpy as np
-from dotenv import load_dotenv
 from livekit import rtc
 from livekit.api import AccessToken, VideoGrants
+from numba import njit
 
-load_dotenv()
+import env_init
+
+try:
+    import uvloop  # faster event loop, not available on Windows
+except ImportError:
+    uvloop = None
+
+env_init.init()
+
+# Speech detection states
+_VAD_SILENT, _VAD_SPEAKING, _VAD_TRAILING = 0, 1, 2
+
+@njit(cache=True, fastmath=True)
+def _sum_abs_i16(a):
+    # Single pass over the int16 PCM, no temporary abs() array.
+    # Returns the integer sum; callers compare against threshold * n
+    # instead of dividing for a mean.
+    s = 0
+    n = len(a)
+    for i in range(n):
+        v = np.int64(a[i])  # widen first: -(-32768) overflows int16
+        s += -v if v < 0 else v
+    return s
+
+@functools.lru_cache(maxsize=64)
+def _signed_token(api_key, api_secret, room, identity, name, hour_bucket):
+    # hour_bucket is part of the cache key only, so a long-running process
+    # re-signs every hour, well within the token's default 6h TTL
+    token = AccessToken(api_key, api_secret)
+    token.with_grants(
+        VideoGrants(
+            room_join=True,
+            room=room,
+            can_publish=True,
+            can_subscribe=True,
+            can_publish_data=True
+        )
+    )
+    token.with_identity(identity)
+    token.with_name(name)
+    return token.to_jwt()
 
 class EchoVoiceAgent:
     def __init__(self):
@@ -26,34 +67,52 @@ class EchoVoiceAgent:
             raise ValueError("Missing environment variables")
         
         # Audio state
-        self.speech_buffer = []
+        # Speech is kept as contiguous int16 samples in a ring buffer
+        # (~30s of 48kHz mono); the oldest samples are overwritten when full
+        self.SAMPLE_RATE = 48000
+        self._ring = np.empty(self.SAMPLE_RATE * 30, dtype=np.int16)
+        self._ring_w = 0  # samples written since the last flush
         self.is_collecting = False
         self.playback_task = None
-        self.last_speech_time = time.time()
+        self._silence_timer = None
+        self._echo_task = None
+        self.last_speech_time = time.monotonic()
+        # block size -> (enter, exit) thresholds scaled by block size
+        self._sum_threshold_cache = {}
         
         # Simple, clear parameters
         self.SILENCE_THRESHOLD = 1.0   # seconds
         self.ECHO_DELAY = 0.5          # seconds
-        self.ENERGY_THRESHOLD = 500    # speech detection
+        self.ENERGY_ENTER_THRESHOLD = 600  # speech onset
+        self.ENERGY_EXIT_THRESHOLD = 300   # speech continues above this
+        self.HANGOVER_FRAMES = 25          # quiet frames kept before going silent
+        self.ENERGY_BLOCK_FRAMES = 4       # frames per energy check
+        self.PLAYBACK_CHUNK = 0.5      # seconds per captured playback frame
+        
+        # Reminder tone
+        self.REMINDER_SAMPLE_RATE = 48000
+        self.REMINDER_DURATION = 0.5   # seconds
+        self.REMINDER_FREQUENCY = 440  # Hz
 
     def generate_token(self):
-        token = AccessToken(self.api_key, self.api_secret)
-        token.with_grants(
-            VideoGrants(
-                room_join=True,
-                room=self.room_name,
-                can_publish=True,
-                can_subscribe=True,
-                can_publish_data=True
-            )
+        return _signed_token(
+            self.api_key,
+            self.api_secret,
+            self.room_name,
+            self.agent_name,
+            self.agent_name,
+            int(time.time() // 3600),
         )
-        token.with_identity(self.agent_name)
-        token.with_name(self.agent_name)
-        return token.to_jwt()
 
     async def connect(self):
         print("🔗 Connecting to LiveKit...")
         
+        # Warm up the JIT so the first real block doesn't stall
+        _sum_abs_i16(np.zeros(1920, dtype=np.int16))
+        
+        # One echo on the shared audio source at a time
+        self._playback_sem = asyncio.Semaphore(1)
+        
         self.room = rtc.Room()
         
         @self.room.on("participant_connected")
@@ -74,67 +133,185 @@ class EchoVoiceAgent:
         await self.room.connect(self.server_url, self.generate_token())
         print(f"✅ Connected to room: {self.room_name}")
         
-        self.audio_source = rtc.AudioSource(48000, 1)
+        self.audio_source = rtc.AudioSource(self.SAMPLE_RATE, 1)
         self.audio_track = rtc.LocalAudioTrack.create_audio_track(
             "echo-track", self.audio_source
         )
         await self.room.local_participant.publish_track(self.audio_track)
         print(f"🎤 Published audio track: {self.audio_track.name}")
         
+        # Reminder tone never changes, build it once
+        t = np.linspace(
+            0, self.REMINDER_DURATION,
+            int(self.REMINDER_SAMPLE_RATE * self.REMINDER_DURATION),
+            endpoint=False,
+        )
+        tone = (np.sin(2 * np.pi * self.REMINDER_FREQUENCY * t) * 32767).astype(np.int16)
+        # capture_frame only reads the frame, so one AudioFrame can be
+        # replayed without copying the payload into a new frame each time
+        self._reminder_frame = rtc.AudioFrame(
+            data=tone.tobytes(),
+            sample_rate=self.REMINDER_SAMPLE_RATE,
+            num_channels=1,
+            samples_per_channel=len(tone),
+        )
+        
         print("🎤 Echo Agent Ready...")
         
-        asyncio.create_task(self.speech_monitor_loop())
         asyncio.create_task(self.silence_loop())
 
     async def handle_audio(self, track):
-        stream = rtc.AudioStream(track)
+        # The ring buffer, energy thresholds and playback all assume
+        # SAMPLE_RATE mono, so have the stream resample to that
+        stream = rtc.AudioStream(track, sample_rate=self.SAMPLE_RATE, num_channels=1)
+        
+        # Staging and VAD state are per track, so one participant's
+        # silence never dilutes or interleaves with another's speech
+        stage = np.empty(4096, dtype=np.int16)
+        stage_len = 0
+        stage_frames = 0
+        vad_state = _VAD_SILENT
+        vad_hangover = 0
         
         async for event in stream:
-            frame = event.frame
+            data = event.frame.data
             
-            # Simple energy detection
-            pcm = np.frombuffer(frame.data, dtype=np.int16)
-            energy = np.abs(pcm).mean()
+            # Stage frames and run one energy check per ENERGY_BLOCK_FRAMES;
+            # a single 10ms frame is too small to amortize the call
+            start = stage_len
+            end = start + len(data)
+            if end > stage.shape[0]:
+                grown = np.empty(2 * end, dtype=np.int16)
+                grown[:start] = stage[:start]
+                stage = grown
+            stage[start:end] = data
+            stage_len = end
+            stage_frames += 1
+            if stage_frames < self.ENERGY_BLOCK_FRAMES:
+                continue
             
-            if energy > self.ENERGY_THRESHOLD:
-                # Interrupt any ongoing playback
-                if self.playback_task and not self.playback_task.done():
-                    self.playback_task.cancel()
-                    print("⏹️ Playback interrupted")
-                
-                # Add to buffer
-                self.speech_buffer.append(frame)
+            # Simple energy detection over the staged block
+            pcm = stage[:end]
+            n = end
+            block_frames = stage_frames
+            stage_len = 0
+            stage_frames = 0
+            
+            thresholds = self._sum_threshold_cache.get(n)
+            if thresholds is None:
+                thresholds = self._sum_threshold_cache[n] = (
+                    self.ENERGY_ENTER_THRESHOLD * n,
+                    self.ENERGY_EXIT_THRESHOLD * n,
+                )
+            enter_sum, exit_sum = thresholds
+            energy = _sum_abs_i16(pcm)
+            
+            # Silent -> Speaking needs the enter threshold; once speaking,
+            # quiet frames go through Trailing for HANGOVER_FRAMES before
+            # falling back to Silent, so energy near a threshold can't flap
+            if vad_state == _VAD_SILENT:
+                if energy <= enter_sum:
+                    continue
+                vad_state = _VAD_SPEAKING
+            elif energy <= exit_sum:
+                if vad_state == _VAD_SPEAKING:
+                    vad_state = _VAD_TRAILING
+                    vad_hangover = 0
+                vad_hangover += block_frames
+                if vad_hangover > self.HANGOVER_FRAMES:
+                    vad_state = _VAD_SILENT
+                else:
+                    self._buffer_samples(pcm)
+                continue
+            else:
+                vad_state = _VAD_SPEAKING
+            
+            # Interrupt any ongoing playback; checked on every speech block,
+            # not just onset, since an echo can start after onset (it waits
+            # out ECHO_DELAY) and must still stop while the user talks
+            if self.playback_task and not self.playback_task.done():
+                self.playback_task.cancel()
+                print("⏹️ Playback interrupted")
+            
+            # Add to buffer
+            self._buffer_samples(pcm)
+            self.last_speech_time = time.monotonic()
+            if not self.is_collecting:
                 self.is_collecting = True
-                self.last_speech_time = time.time()
-                print(f"🎤 Received speech | Buffer: {len(self.speech_buffer)}")
-
-    async def speech_monitor_loop(self):
-        while True:
-            await asyncio.sleep(0.1)
+            print(f"🎤 Received speech | Buffer: {self._ring_w / self.SAMPLE_RATE:.2f}s")
             
-            if self.is_collecting and len(self.speech_buffer) > 0:
-                silence_duration = time.time() - self.last_speech_time
-                
-                if silence_duration > self.SILENCE_THRESHOLD:
-                    print(f"🛑 Speech ended | Buffer: {len(self.speech_buffer)}")
-                    
-                    frames_to_play = self.speech_buffer.copy()
-                    self.speech_buffer.clear()
-                    self.is_collecting = False
-                    
-                    # Wait for echo delay
-                    await asyncio.sleep(self.ECHO_DELAY)
-                    
-                    if frames_to_play:
-                        print(f"📢 Playing {len(frames_to_play)} frames")
-                        self.playback_task = asyncio.create_task(
-                            self.play_buffer(frames_to_play)
-                        )
-
-    async def play_buffer(self, frames):
+            # Re-arm speech end detection
+            if self._silence_timer:
+                self._silence_timer.cancel()
+            self._silence_timer = asyncio.get_running_loop().call_later(
+                self.SILENCE_THRESHOLD, self._on_silence
+            )
+
+    def _buffer_samples(self, pcm):
+        size = self._ring.shape[0]
+        n = len(pcm)
+        pos = self._ring_w % size
+        head = min(n, size - pos)
+        self._ring[pos:pos + head] = pcm[:head]
+        if head < n:
+            self._ring[:n - head] = pcm[head:]
+        self._ring_w += n
+
+    def _take_buffered(self):
+        # Copy out in playback order; the ring is reused for the next utterance
+        size = self._ring.shape[0]
+        if self._ring_w <= size:
+            pcm = self._ring[:self._ring_w].copy()
+        else:
+            pos = self._ring_w % size
+            pcm = np.concatenate((self._ring[pos:], self._ring[:pos]))
+        self._ring_w = 0
+        return pcm
+
+    def _on_silence(self):
+        self._silence_timer = None
+        # Keep a reference: the loop only holds tasks weakly, and this one
+        # sits in asyncio.sleep(ECHO_DELAY) before it starts playback
+        self._echo_task = asyncio.create_task(self.echo_speech())
+
+    async def echo_speech(self):
+        if not self.is_collecting or self._ring_w == 0:
+            return
+        
+        print(f"🛑 Speech ended | Buffer: {self._ring_w / self.SAMPLE_RATE:.2f}s")
+        
+        pcm_to_play = self._take_buffered()
+        self.is_collecting = False
+        
+        # Wait for echo delay
+        await asyncio.sleep(self.ECHO_DELAY)
+        
+        if len(pcm_to_play):
+            print(f"📢 Playing {len(pcm_to_play) / self.SAMPLE_RATE:.2f}s")
+            # A newer echo supersedes the old one; cancel it before dropping
+            # the only reference, or it keeps holding _playback_sem
+            if self.playback_task and not self.playback_task.done():
+                self.playback_task.cancel()
+            self.playback_task = asyncio.create_task(
+                self.play_buffer(pcm_to_play)
+            )
+
+    async def play_buffer(self, pcm):
+        # Replay the contiguous buffer in a few large chunks instead of
+        # one capture_frame per 10-20ms frame
+        chunk_samples = int(self.SAMPLE_RATE * self.PLAYBACK_CHUNK)
+        
         try:
-            for frame in frames:
-                await self.audio_source.capture_frame(frame)
+            async with self._playback_sem:
+                for start in range(0, len(pcm), chunk_samples):
+                    chunk = pcm[start:start + chunk_samples]
+                    frame = rtc.AudioFrame(
+                        data=chunk.tobytes(),
+                        sample_rate=self.SAMPLE_RATE,
+                        num_channels=1,
+                        samples_per_channel=len(chunk),
+                    )
+                    await self.audio_source.capture_frame(frame)
             print("✅ Playback finished")
         except asyncio.CancelledError:
             print("⏹️ Playback cancelled")
@@ -143,27 +320,13 @@ class EchoVoiceAgent:
         while True:
             await asyncio.sleep(2)
             
-            if not self.is_collecting and time.time() - self.last_speech_time > 20:
+            if not self.is_collecting and time.monotonic() - self.last_speech_time > 20:
                 print("🔔 20 seconds silence → reminder")
                 await self.play_reminder()
-                self.last_speech_time = time.time()
+                self.last_speech_time = time.monotonic()
 
     async def play_reminder(self):
-        sample_rate = 48000
-        duration = 0.5
-        frequency = 440
-        
-        t = np.linspace(0, duration, int(sample_rate * duration), endpoint=False)
-        tone = (np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16)
-        
-        frame = rtc.AudioFrame(
-            data=tone.tobytes(),
-            sample_rate=sample_rate,
-            num_channels=1,
-            samples_per_channel=len(tone),
-        )
-        
-        await self.audio_source.capture_frame(frame)
+        await self.audio_source.capture_frame(self._reminder_frame)
 
     async def run(self):
         await self.connect()
@@ -172,4 +335,7 @@ class EchoVoiceAgent:
 
 if __name__ == "__main__":
     agent = EchoVoiceAgent()
-    asyncio.run(agent.run())
+    if uvloop is not None:
+        uvloop.run(agent.run())
+    else:
+        asyncio.run(agent.run())